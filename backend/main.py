@@ -1,11 +1,24 @@
 # backend/main.py
+import asyncio
+import csv
+import hashlib
+import io
+import json
 import os
+import random
+import re
+import threading
+import time
+import unicodedata
 import uuid
+from collections import OrderedDict
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
-from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi import FastAPI, HTTPException, Depends, Header, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import google.generativeai as genai
 import secrets  # 6자리 코드 생성용
@@ -32,6 +45,32 @@ ADMIN_API_KEY = os.getenv("ADMIN_API_KEY", "dev-admin-key")
 # 사용할 모델 이름
 MODEL_NAME = "gemini-1.5-pro"
 
+# 시뮬레이션(simulation_id)별 /chat 예산. 리포트 사용량은 포함하지 않는다. 0 이면 제한하지 않는다.
+SIM_MAX_TURNS = int(os.getenv("SIM_MAX_TURNS", "40"))
+SIM_MAX_TOKENS = int(os.getenv("SIM_MAX_TOKENS", "200000"))
+# 예산의 이 비율을 넘기면 답변 길이를 제한해 대화를 마무리하도록 유도
+SIM_BUDGET_SOFT_RATIO = float(os.getenv("SIM_BUDGET_SOFT_RATIO", "0.8"))
+SIM_WRAPUP_MAX_OUTPUT_TOKENS = int(os.getenv("SIM_WRAPUP_MAX_OUTPUT_TOKENS", "256"))
+
+# Idempotency-Key 로 저장한 /chat, /report 응답 보관 기간과 최대 개수
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "600"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "5000"))
+
+# 대화 중에 리포트 초안을 백그라운드로 미리 만들어 두는 모드
+REPORT_DRAFT_ENABLED = os.getenv("REPORT_DRAFT_ENABLED", "false").lower() in ("1", "true", "yes")
+REPORT_DRAFT_CONCURRENCY = int(os.getenv("REPORT_DRAFT_CONCURRENCY", "2"))
+REPORT_DRAFT_MAX_ENTRIES = int(os.getenv("REPORT_DRAFT_MAX_ENTRIES", "1000"))
+# /report 가 마지막 턴을 반영 중인 초안을 기다려 주는 최대 시간(초). 넘으면 전체 생성으로 대신한다.
+REPORT_DRAFT_WAIT_SECONDS = float(os.getenv("REPORT_DRAFT_WAIT_SECONDS", "3"))
+
+# 교육 코드 일괄 발급 시 한 번에 만들 수 있는 최대 개수
+ACCESS_BULK_MAX_COUNT = int(os.getenv("ACCESS_BULK_MAX_COUNT", "10000"))
+
+# 첫 턴 응답 캐시 (페르소나 + 프롬프트 버전 + 정규화된 리더 발화 기준)
+OPENING_CACHE_ENABLED = os.getenv("OPENING_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+OPENING_CACHE_MAX_KEYS = int(os.getenv("OPENING_CACHE_MAX_KEYS", "256"))
+OPENING_CACHE_POOL_SIZE = int(os.getenv("OPENING_CACHE_POOL_SIZE", "3"))
+
 app = FastAPI()
 
 # CORS – 프론트(Netlify)에서 호출 가능하도록
@@ -88,6 +127,129 @@ PERSONA_PROMPTS: Dict[str, str] = {
 """,
 }
 
+# -----------------------------
+# 1-A. 페르소나 프롬프트 레지스트리 (버전 관리 + 사전 조립)
+# -----------------------------
+# 새 세션의 시스템 프롬프트 뒤에 붙는 안내문
+SESSION_INSTRUCTION = (
+    "\n\n지금부터 너는 위 설명에 나온 팀원으로만 행동한다."
+    " 이후 대화에서는 팀장(리더)의 말을 듣고 그때그때 자연스럽게 대답해라."
+)
+
+# 매 턴 리더의 발화를 감싸는 지시문 ({message} 자리에 리더 발화가 들어간다)
+TURN_MESSAGE_PLACEHOLDER = "{message}"
+DEFAULT_TURN_TEMPLATE = (
+    "리더: {message}\n\n"
+    "위 문장을 방금 들은 팀원 입장에서 대답해라.\n"
+    "- 자연스러운 한국어 존댓말\n"
+    "- 2~4문장\n"
+    "- AI, 프롬프트, 시뮬레이션 같은 단어는 절대 언급하지 말 것\n"
+    "- 지금 느끼는 감정, 걱정, 기대를 솔직하게 표현할 것"
+)
+
+
+class PersonaPromptVersion(BaseModel):
+    persona_key: str
+    version: int
+    system_prompt: str
+    turn_template: str = DEFAULT_TURN_TEMPLATE
+    note: Optional[str] = ""
+    created_at: str
+    is_active: bool = False
+
+
+class CompiledPersonaPrompt:
+    """
+    한 버전의 프롬프트를 미리 조립해 둔 결과.
+    세션 프리앰블과 턴 래퍼(앞/뒤 문자열)를 버전당 한 번만 만들어 두고,
+    요청 처리 중에는 문자열 결합만 한다.
+    """
+
+    __slots__ = ("persona_key", "version", "session_preamble", "turn_prefix", "turn_suffix")
+
+    def __init__(self, persona_key: str, version: int, system_prompt: str, turn_template: str):
+        if turn_template.count(TURN_MESSAGE_PLACEHOLDER) != 1:
+            raise ValueError("turn_template 에는 {message} 가 정확히 한 번 들어가야 합니다.")
+        self.persona_key = persona_key
+        self.version = version
+        self.session_preamble = system_prompt + SESSION_INSTRUCTION
+        self.turn_prefix, self.turn_suffix = turn_template.split(TURN_MESSAGE_PLACEHOLDER)
+
+    def render_turn(self, message: str) -> str:
+        return self.turn_prefix + message + self.turn_suffix
+
+
+# persona_key -> 버전 목록 (버전 번호 = 인덱스 + 1)
+PERSONA_PROMPT_VERSIONS: Dict[str, List[PersonaPromptVersion]] = {}
+
+# (persona_key, version) -> 사전 조립된 프롬프트
+COMPILED_PERSONA_PROMPTS: Dict[Tuple[str, int], CompiledPersonaPrompt] = {}
+
+# persona_key -> 현재 활성 버전. 값 교체 한 번으로 원자적으로 바뀐다.
+ACTIVE_PERSONA_PROMPTS: Dict[str, CompiledPersonaPrompt] = {}
+
+DEFAULT_PERSONA_KEY = "quiet"
+
+_persona_registry_lock = threading.Lock()
+
+
+def _activate_locked(persona_key: str, version: int) -> PersonaPromptVersion:
+    """_persona_registry_lock 을 잡은 상태에서 호출한다."""
+    versions = PERSONA_PROMPT_VERSIONS[persona_key]
+    for v in versions:
+        v.is_active = v.version == version
+    ACTIVE_PERSONA_PROMPTS[persona_key] = COMPILED_PERSONA_PROMPTS[(persona_key, version)]
+    return versions[version - 1]
+
+
+def publish_persona_prompt(
+    persona_key: str,
+    system_prompt: str,
+    turn_template: Optional[str] = None,
+    note: Optional[str] = "",
+) -> PersonaPromptVersion:
+    """새 프롬프트 버전을 등록하고 바로 활성화한다. (진행 중인 세션은 기존 버전 유지)"""
+    turn_template = turn_template or DEFAULT_TURN_TEMPLATE
+
+    with _persona_registry_lock:
+        versions = PERSONA_PROMPT_VERSIONS.setdefault(persona_key, [])
+        version = len(versions) + 1
+        # 조립(검증)이 실패하면 아무것도 바뀌지 않는다
+        compiled = CompiledPersonaPrompt(persona_key, version, system_prompt, turn_template)
+        versions.append(
+            PersonaPromptVersion(
+                persona_key=persona_key,
+                version=version,
+                system_prompt=system_prompt,
+                turn_template=turn_template,
+                note=note or "",
+                created_at=datetime.utcnow().isoformat(),
+            )
+        )
+        COMPILED_PERSONA_PROMPTS[(persona_key, version)] = compiled
+        return _activate_locked(persona_key, version)
+
+
+def activate_persona_prompt(persona_key: str, version: int) -> PersonaPromptVersion:
+    """이미 등록된 버전으로 되돌린다(롤백)."""
+    with _persona_registry_lock:
+        if (persona_key, version) not in COMPILED_PERSONA_PROMPTS:
+            raise KeyError(version)
+        return _activate_locked(persona_key, version)
+
+
+def get_active_persona_prompt(persona: str) -> CompiledPersonaPrompt:
+    """알 수 없는 페르소나는 기본(quiet) 페르소나로 대체한다."""
+    compiled = ACTIVE_PERSONA_PROMPTS.get(persona)
+    if compiled is None:
+        compiled = ACTIVE_PERSONA_PROMPTS[DEFAULT_PERSONA_KEY]
+    return compiled
+
+
+for _key, _prompt in PERSONA_PROMPTS.items():
+    publish_persona_prompt(_key, _prompt, note="초기 버전")
+
+
 # ============================================================
 # 1-B. 링크 + 6자리 교육 코드 (참여자 액세스 제어)
 # ============================================================
@@ -108,6 +270,20 @@ class AdminCreateAccessRequest(BaseModel):
     access_code: Optional[str] = None  # 비워두면 서버가 6자리 자동 생성
 
 
+# 관리자 일괄 생성/가져오기 요청 모델
+class AdminBulkAccessRequest(BaseModel):
+    company_id: str
+    campaign_code: str
+    count: int = 0                            # 서버가 자동 생성할 코드 수
+    access_codes: Optional[List[str]] = None  # 직접 지정(가져오기)할 코드 목록
+
+
+class AdminBulkDeactivateRequest(BaseModel):
+    company_id: str
+    campaign_code: str
+    revoke_sessions: bool = True  # 이미 발급된 access_token 도 함께 만료
+
+
 # /access/verify 요청/응답 모델
 class AccessVerifyRequest(BaseModel):
     company_id: str
@@ -139,21 +315,134 @@ ACCESS_CODES: List[AccessCode] = [
     )
 ]
 
+# (company_id, campaign_code, access_code) -> 교육 코드. 캠페인 내 코드 중복을 막는 유니크 인덱스.
+AccessCodeKey = Tuple[str, str, str]
+ACCESS_CODE_INDEX: Dict[AccessCodeKey, AccessCode] = {
+    (item.company_id, item.campaign_code, item.access_code): item for item in ACCESS_CODES
+}
+
+_access_codes_lock = threading.Lock()
+
 # 발급된 access_token 저장소 (MVP에서는 메모리)
 ACCESS_SESSIONS: Dict[str, Dict] = {}
 
 
 def validate_access_code(company_id: str, campaign_code: str, access_code: str) -> bool:
-    """ACCESS_CODES에서 유효한 코드인지 확인"""
-    for item in ACCESS_CODES:
-        if (
-            item.company_id == company_id
-            and item.campaign_code == campaign_code
-            and item.access_code == access_code
-            and item.active
-        ):
-            return True
-    return False
+    """ACCESS_CODE_INDEX에서 유효한 코드인지 확인"""
+    item = ACCESS_CODE_INDEX.get((company_id, campaign_code, access_code))
+    return item is not None and item.active
+
+
+ACCESS_CODE_PATTERN = re.compile(r"^[0-9]{6}$")  # 참여자에게 공유되는 6자리 숫자 코드
+
+# 일괄 발급 단위: (company_id, campaign_code, 자동 생성 개수, 직접 지정한 코드 목록)
+AccessCodeBatch = Tuple[str, str, int, List[str]]
+
+
+def _build_access_codes_locked(
+    company_id: str,
+    campaign_code: str,
+    count: int,
+    access_codes: List[str],
+) -> List[AccessCode]:
+    """_access_codes_lock 을 잡은 상태에서 호출한다. 검증과 코드 생성만 하고 저장은 하지 않는다."""
+    new_codes: List[str] = []
+    taken = set()
+    for code in access_codes:
+        if not ACCESS_CODE_PATTERN.match(code):
+            raise HTTPException(
+                status_code=400,
+                detail=f"교육 코드는 6자리 숫자여야 합니다: {code!r}",
+            )
+        if (company_id, campaign_code, code) in ACCESS_CODE_INDEX or code in taken:
+            raise HTTPException(status_code=409, detail=f"이미 존재하는 교육 코드입니다: {code}")
+        taken.add(code)
+        new_codes.append(code)
+
+    if count:
+        existing = sum(
+            1 for c, p, _ in ACCESS_CODE_INDEX if c == company_id and p == campaign_code
+        )
+        # 6자리 코드 공간의 절반 이상을 쓰면 랜덤 생성이 느려지므로 막는다
+        if existing + len(new_codes) + count > 10**6 // 2:
+            raise HTTPException(
+                status_code=400,
+                detail="해당 캠페인에 발급할 수 있는 6자리 코드가 부족합니다.",
+            )
+        for _ in range(count):
+            code = f"{secrets.randbelow(10**6):06d}"
+            while (company_id, campaign_code, code) in ACCESS_CODE_INDEX or code in taken:
+                code = f"{secrets.randbelow(10**6):06d}"
+            taken.add(code)
+            new_codes.append(code)
+
+    return [
+        AccessCode(
+            id=str(uuid.uuid4()),
+            company_id=company_id,
+            campaign_code=campaign_code,
+            access_code=code,
+            active=True,
+        )
+        for code in new_codes
+    ]
+
+
+def create_access_codes(batches: List[AccessCodeBatch]) -> List[AccessCode]:
+    """
+    여러 캠페인의 교육 코드를 한 번에 등록한다.
+    하나라도 중복/오류가 있으면 아무것도 등록하지 않는다. (전부 성공 또는 전부 실패)
+    """
+    total = sum(count + len(codes) for _, _, count, codes in batches)
+    if any(count < 0 for _, _, count, _ in batches) or total > ACCESS_BULK_MAX_COUNT:
+        raise HTTPException(
+            status_code=400,
+            detail=f"한 번에 발급할 수 있는 코드는 최대 {ACCESS_BULK_MAX_COUNT}개입니다.",
+        )
+    if total == 0:
+        raise HTTPException(
+            status_code=400,
+            detail="발급할 교육 코드가 없습니다. count 또는 access_codes 를 지정해 주세요.",
+        )
+
+    with _access_codes_lock:
+        created: List[AccessCode] = []
+        for company_id, campaign_code, count, codes in batches:
+            created.extend(
+                _build_access_codes_locked(
+                    company_id, campaign_code, count, [c.strip() for c in codes]
+                )
+            )
+        ACCESS_CODES.extend(created)
+        ACCESS_CODE_INDEX.update(
+            {(a.company_id, a.campaign_code, a.access_code): a for a in created}
+        )
+    return created
+
+
+ACCESS_CODE_CSV_FIELDS = ["id", "company_id", "campaign_code", "access_code", "active"]
+
+
+def access_codes_csv_response(codes: List[AccessCode], filename: str) -> StreamingResponse:
+    """교육 코드 목록을 CSV 로 한 줄씩 흘려보낸다."""
+
+    def rows():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(ACCESS_CODE_CSV_FIELDS)
+        for a in codes:
+            writer.writerow([a.id, a.company_id, a.campaign_code, a.access_code, a.active])
+            if buf.tell() > 64 * 1024:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+
+    return StreamingResponse(
+        rows(),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 
 async def get_current_access(
@@ -218,17 +507,94 @@ async def admin_create_access(
     회사별/캠페인별 6자리 교육 코드를 생성한다.
     access_code 를 비워두면 서버가 6자리 랜덤 코드 생성.
     """
-    code = req.access_code or f"{secrets.randbelow(10**6):06d}"
+    if req.access_code:
+        batch = (req.company_id, req.campaign_code, 0, [req.access_code])
+    else:
+        batch = (req.company_id, req.campaign_code, 1, [])
+    return create_access_codes([batch])[0]
 
-    access = AccessCode(
-        id=str(uuid.uuid4()),
-        company_id=req.company_id,
-        campaign_code=req.campaign_code,
-        access_code=code,
-        active=True,
+
+# --- 관리자용: 교육 코드 일괄 생성 (CSV 로 응답) ---
+@app.post("/admin/access/bulk")
+async def admin_bulk_create_access(
+    req: AdminBulkAccessRequest,
+    _: bool = Depends(verify_admin),
+):
+    """
+    회사/캠페인 단위로 교육 코드를 한 번에 발급한다.
+    access_codes 로 지정한 코드는 그대로, count 만큼은 서버가 중복 없이 생성한다.
+    """
+    created = create_access_codes(
+        [(req.company_id, req.campaign_code, req.count, req.access_codes or [])]
     )
-    ACCESS_CODES.append(access)
-    return access
+    return access_codes_csv_response(
+        created, f"access_codes_{req.company_id}_{req.campaign_code}.csv"
+    )
+
+
+# --- 관리자용: CSV 가져오기 (company_id,campaign_code,access_code 헤더) ---
+@app.post("/admin/access/import")
+async def admin_import_access(
+    request: Request,
+    _: bool = Depends(verify_admin),
+):
+    """
+    CSV 본문(text/csv)을 읽어 교육 코드를 등록한다.
+    access_code 칸을 비워두면 서버가 생성한다. 한 줄이라도 실패하면 전체를 등록하지 않는다.
+    """
+    raw = await request.body()
+    try:
+        body = raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        # 한국어 Excel 의 기본 CSV 저장 형식(CP949)도 받아준다
+        try:
+            body = raw.decode("cp949")
+        except UnicodeDecodeError:
+            raise HTTPException(
+                status_code=400,
+                detail="CSV 파일을 읽을 수 없습니다. UTF-8 형식의 CSV로 저장해 주세요.",
+            )
+
+    # 캠페인별로 [자동 생성 개수, 지정 코드 목록]을 모은다
+    groups: Dict[Tuple[str, str], List] = {}
+    reader = csv.DictReader(io.StringIO(body), strict=True)
+    try:
+        if not reader.fieldnames or not {"company_id", "campaign_code"} <= set(reader.fieldnames):
+            raise HTTPException(
+                status_code=400,
+                detail="CSV 헤더에 company_id, campaign_code 가 필요합니다.",
+            )
+        for row in reader:
+            company_id = (row.get("company_id") or "").strip()
+            campaign_code = (row.get("campaign_code") or "").strip()
+            if not company_id or not campaign_code:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"{reader.line_num}번째 줄에 company_id / campaign_code 가 없습니다.",
+                )
+            group = groups.setdefault((company_id, campaign_code), [0, []])
+            code = (row.get("access_code") or "").strip()
+            if code and not ACCESS_CODE_PATTERN.match(code):
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"{reader.line_num}번째 줄의 교육 코드는 6자리 숫자여야 합니다: {code!r}",
+                )
+            if code:
+                group[1].append(code)
+            else:
+                group[0] += 1
+    except csv.Error as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"CSV 형식이 올바르지 않습니다({reader.line_num}번째 줄): {e}",
+        )
+
+    batches = [
+        (company_id, campaign_code, count, codes)
+        for (company_id, campaign_code), (count, codes) in groups.items()
+    ]
+    created = create_access_codes(batches)
+    return access_codes_csv_response(created, "access_codes_import.csv")
 
 
 # --- 관리자용: 교육 코드 목록 조회 ---
@@ -250,6 +616,46 @@ async def admin_deactivate_access(
     raise HTTPException(status_code=404, detail="해당 ID의 교육 코드를 찾을 수 없습니다.")
 
 
+# --- 관리자용: 캠페인 전체 코드 비활성화 ---
+@app.post("/admin/access/bulk/deactivate")
+async def admin_bulk_deactivate_access(
+    req: AdminBulkDeactivateRequest,
+    _: bool = Depends(verify_admin),
+):
+    with _access_codes_lock:
+        matched = [
+            item
+            for item in ACCESS_CODES
+            if item.company_id == req.company_id and item.campaign_code == req.campaign_code
+        ]
+        deactivated = sum(1 for item in matched if item.active)
+        for item in matched:
+            item.active = False
+
+    if not matched:
+        raise HTTPException(
+            status_code=404,
+            detail="해당 회사/캠페인의 교육 코드를 찾을 수 없습니다.",
+        )
+
+    revoked = 0
+    if req.revoke_sessions:
+        for token, session in list(ACCESS_SESSIONS.items()):
+            if (
+                session["company_id"] == req.company_id
+                and session["campaign_code"] == req.campaign_code
+            ):
+                ACCESS_SESSIONS.pop(token, None)
+                revoked += 1
+
+    return {
+        "status": "ok",
+        "message": f"{deactivated}개의 교육 코드를 비활성화했습니다.",
+        "deactivated": deactivated,
+        "revoked_sessions": revoked,
+    }
+
+
 # ============================================================
 # 2. 관리자용 도메인: 고객사 / 진단 / 페르소나 / 데이터 로그
 # ============================================================
@@ -395,12 +801,13 @@ async def admin_update_diagnostic(
     raise HTTPException(status_code=404, detail="해당 진단 ID를 찾을 수 없습니다.")
 
 
-# --- 2-3) 페르소나 관리 (지금은 read-only + 활성/비활성만) ---
+# --- 2-3) 페르소나 관리 (활성/비활성 + 프롬프트 버전 관리) ---
 class PersonaAdmin(BaseModel):
     key: str          # quiet / idea / social ...
     name: str         # 화면에 보이는 이름
     description: str
     is_active: bool = True
+    prompt_version: int = 1  # 현재 활성 프롬프트 버전
 
 
 PERSONA_ADMIN: List[PersonaAdmin] = [
@@ -428,6 +835,36 @@ PERSONA_ADMIN: List[PersonaAdmin] = [
 class PersonaUpdateRequest(BaseModel):
     is_active: Optional[bool] = None
     description: Optional[str] = None
+    system_prompt: Optional[str] = None  # 값이 있으면 새 프롬프트 버전으로 등록
+
+
+class PersonaPromptCreateRequest(BaseModel):
+    system_prompt: str
+    turn_template: Optional[str] = None  # 비워두면 기본 턴 지시문 사용
+    note: Optional[str] = ""
+
+
+def find_persona_admin(persona_key: str) -> PersonaAdmin:
+    for p in PERSONA_ADMIN:
+        if p.key == persona_key:
+            return p
+    raise HTTPException(status_code=404, detail="해당 페르소나 key를 찾을 수 없습니다.")
+
+
+def publish_persona_prompt_or_400(
+    persona: PersonaAdmin,
+    system_prompt: str,
+    turn_template: Optional[str] = None,
+    note: Optional[str] = "",
+) -> PersonaPromptVersion:
+    if not system_prompt.strip():
+        raise HTTPException(status_code=400, detail="system_prompt 가 비어 있습니다.")
+    try:
+        version = publish_persona_prompt(persona.key, system_prompt, turn_template, note)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    persona.prompt_version = version.version
+    return version
 
 
 @app.get("/admin/personas", response_model=List[PersonaAdmin])
@@ -441,14 +878,56 @@ async def admin_update_persona(
     req: PersonaUpdateRequest,
     _: bool = Depends(verify_admin),
 ):
-    for p in PERSONA_ADMIN:
-        if p.key == persona_key:
-            if req.is_active is not None:
-                p.is_active = req.is_active
-            if req.description is not None:
-                p.description = req.description
-            return p
-    raise HTTPException(status_code=404, detail="해당 페르소나 key를 찾을 수 없습니다.")
+    p = find_persona_admin(persona_key)
+    if req.system_prompt is not None:
+        publish_persona_prompt_or_400(p, req.system_prompt, note="페르소나 수정")
+    if req.is_active is not None:
+        p.is_active = req.is_active
+    if req.description is not None:
+        p.description = req.description
+    return p
+
+
+@app.get("/admin/personas/{persona_key}/prompts", response_model=List[PersonaPromptVersion])
+async def admin_list_persona_prompts(
+    persona_key: str,
+    _: bool = Depends(verify_admin),
+):
+    find_persona_admin(persona_key)
+    return PERSONA_PROMPT_VERSIONS.get(persona_key, [])
+
+
+@app.post("/admin/personas/{persona_key}/prompts", response_model=PersonaPromptVersion)
+async def admin_create_persona_prompt(
+    persona_key: str,
+    req: PersonaPromptCreateRequest,
+    _: bool = Depends(verify_admin),
+):
+    """
+    새 프롬프트 버전을 등록하고 즉시 활성화한다. (재시작 없이 반영)
+    이미 진행 중인 시뮬레이션은 시작할 때의 버전을 그대로 사용한다.
+    """
+    p = find_persona_admin(persona_key)
+    return publish_persona_prompt_or_400(p, req.system_prompt, req.turn_template, req.note)
+
+
+@app.post(
+    "/admin/personas/{persona_key}/prompts/{version}/activate",
+    response_model=PersonaPromptVersion,
+)
+async def admin_activate_persona_prompt(
+    persona_key: str,
+    version: int,
+    _: bool = Depends(verify_admin),
+):
+    """이전 버전으로 롤백하거나 특정 버전을 다시 활성화한다."""
+    p = find_persona_admin(persona_key)
+    try:
+        activated = activate_persona_prompt(persona_key, version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="해당 프롬프트 버전을 찾을 수 없습니다.")
+    p.prompt_version = activated.version
+    return activated
 
 
 # --- 2-4) 데이터 축적: 사용자 히스토리(리포트 로그) ---
@@ -463,6 +942,7 @@ class ConversationLog(BaseModel):
     situation: Optional[str] = None
     last_user_message: Optional[str] = None
     last_coach_reply: Optional[str] = None
+    prompt_version: Optional[int] = None
 
 
 CONVERSATION_LOGS: List[ConversationLog] = []
@@ -481,47 +961,404 @@ async def admin_list_logs(_: bool = Depends(verify_admin)):
 # ============================================================
 SESSIONS: Dict[str, "genai.ChatSession"] = {}
 
+# simulation_id -> 턴 직렬화용 락 (예산 검사 → Gemini 호출 → 사용량 기록을 한 번에)
+SESSION_LOCKS: Dict[str, asyncio.Lock] = {}
+
+# simulation_id -> 세션을 만들 때 사용한 프롬프트 버전 (관리자 수정과 무관하게 고정)
+SESSION_PROMPTS: Dict[str, CompiledPersonaPrompt] = {}
+
+
+# 시뮬레이션별 실행 기록 (어떤 프롬프트 버전으로 진행했는지)
+class SimulationRecord(BaseModel):
+    simulation_id: str
+    company_id: str
+    campaign_code: str
+    persona: str
+    prompt_version: int
+    created_at: str
 
-def get_or_create_session(simulation_id: Optional[str], persona: str):
-    """simulation_id로 Gemini chat 세션을 찾아오거나 새로 만든다."""
-    persona_key = persona if persona in PERSONA_PROMPTS else "quiet"
-    system_prompt = PERSONA_PROMPTS[persona_key]
 
+SIMULATIONS: Dict[str, SimulationRecord] = {}
+
+
+def find_owned_simulation(
+    simulation_id: Optional[str],
+    access: AccessContext,
+) -> Optional[SimulationRecord]:
+    """접근 토큰과 같은 회사/캠페인에서 만들어진 시뮬레이션만 돌려준다."""
+    record = SIMULATIONS.get(simulation_id) if simulation_id else None
+    if (
+        record is None
+        or record.company_id != access.company_id
+        or record.campaign_code != access.campaign_code
+    ):
+        return None
+    return record
+
+
+def get_or_create_session(
+    simulation_id: Optional[str],
+    persona: str,
+    access: AccessContext,
+):
+    """simulation_id로 Gemini chat 세션을 찾아오거나 새로 만든다."""
     # 새 세션이 필요한 경우
     if not simulation_id or simulation_id not in SESSIONS:
         simulation_id = simulation_id or str(uuid.uuid4())
+        compiled = get_active_persona_prompt(persona)
         model = genai.GenerativeModel(MODEL_NAME)
 
         # system prompt를 history의 첫 user 메시지로 넣어둔다
         chat = model.start_chat(
-            history=[
-                {
-                    "role": "user",
-                    "parts": [
-                        system_prompt
-                        + "\n\n지금부터 너는 위 설명에 나온 팀원으로만 행동한다."
-                        " 이후 대화에서는 팀장(리더)의 말을 듣고 그때그때 자연스럽게 대답해라."
-                    ],
-                }
-            ]
+            history=[{"role": "user", "parts": [compiled.session_preamble]}]
         )
         SESSIONS[simulation_id] = chat
+        SESSION_LOCKS[simulation_id] = asyncio.Lock()
+        SESSION_PROMPTS[simulation_id] = compiled
+        SIMULATIONS[simulation_id] = SimulationRecord(
+            simulation_id=simulation_id,
+            company_id=access.company_id,
+            campaign_code=access.campaign_code,
+            persona=compiled.persona_key,
+            prompt_version=compiled.version,
+            created_at=datetime.utcnow().isoformat(),
+        )
+
+    return simulation_id, SESSIONS[simulation_id], SESSION_PROMPTS[simulation_id]
+
 
-    return simulation_id, SESSIONS[simulation_id]
+@app.get("/admin/simulations", response_model=List[SimulationRecord])
+async def admin_list_simulations(_: bool = Depends(verify_admin)):
+    return list(SIMULATIONS.values())
+
+
+# ============================================================
+# 3-B. 토큰 사용량 집계 + 시뮬레이션 예산
+# ============================================================
+class UsageTotals(BaseModel):
+    calls: int = 0          # Gemini 호출 수 (채팅 + 리포트)
+    turns: int = 0          # 채팅 턴 수
+    input_tokens: int = 0
+    output_tokens: int = 0
+    total_tokens: int = 0
+
+
+class UsageSummary(BaseModel):
+    total: UsageTotals
+    companies: Dict[str, UsageTotals]
+    campaigns: Dict[str, UsageTotals]  # key: "company_id/campaign_code"
+
+
+USAGE_TOTAL = UsageTotals()
+USAGE_BY_SIMULATION: Dict[str, UsageTotals] = {}
+# 리포트(초안 + 최종) 사용량. 채팅 예산(check_chat_budget)과 분리해서 센다.
+USAGE_BY_SIMULATION_REPORTS: Dict[str, UsageTotals] = {}
+USAGE_BY_COMPANY: Dict[str, UsageTotals] = {}
+USAGE_BY_CAMPAIGN: Dict[str, UsageTotals] = {}
+
+_usage_lock = threading.Lock()
+
+
+def record_usage(
+    access: AccessContext,
+    simulation_id: Optional[str],
+    response,
+    is_turn: bool = False,
+    is_report: bool = False,
+) -> None:
+    """
+    Gemini 응답의 usage_metadata 를 시뮬레이션/회사/캠페인 단위로 누적한다.
+    is_report 이면 시뮬레이션 단위는 리포트 전용 집계에 넣어 채팅 예산을 쓰지 않게 한다.
+    """
+    meta = getattr(response, "usage_metadata", None)
+    input_tokens = getattr(meta, "prompt_token_count", 0) or 0
+    output_tokens = getattr(meta, "candidates_token_count", 0) or 0
+    total_tokens = getattr(meta, "total_token_count", 0) or (input_tokens + output_tokens)
+
+    with _usage_lock:
+        buckets = [
+            USAGE_TOTAL,
+            USAGE_BY_COMPANY.setdefault(access.company_id, UsageTotals()),
+            USAGE_BY_CAMPAIGN.setdefault(
+                f"{access.company_id}/{access.campaign_code}", UsageTotals()
+            ),
+        ]
+        if simulation_id:
+            by_simulation = USAGE_BY_SIMULATION_REPORTS if is_report else USAGE_BY_SIMULATION
+            buckets.append(by_simulation.setdefault(simulation_id, UsageTotals()))
+        for b in buckets:
+            b.calls += int(response is not None)  # 캐시 응답은 호출 없이 턴만 센다
+            b.turns += int(is_turn)
+            b.input_tokens += input_tokens
+            b.output_tokens += output_tokens
+            b.total_tokens += total_tokens
+
+
+def check_chat_budget(simulation_id: str) -> Optional[Dict[str, int]]:
+    """
+    예산을 다 쓴 시뮬레이션은 429 로 막는다.
+    예산이 얼마 남지 않았으면 답변 길이를 줄이는 generation_config 를 돌려준다.
+    """
+    usage = USAGE_BY_SIMULATION.get(simulation_id)
+    if usage is None:
+        return None
+
+    ratios = []
+    if SIM_MAX_TURNS > 0:
+        ratios.append(usage.turns / SIM_MAX_TURNS)
+    if SIM_MAX_TOKENS > 0:
+        ratios.append(usage.total_tokens / SIM_MAX_TOKENS)
+    ratio = max(ratios, default=0.0)
+
+    if ratio >= 1.0:
+        raise HTTPException(
+            status_code=429,
+            detail="이번 시뮬레이션의 대화 한도에 도달했습니다. 대화를 마치고 리포트를 확인해 주세요.",
+        )
+    if ratio >= SIM_BUDGET_SOFT_RATIO:
+        return {"max_output_tokens": SIM_WRAPUP_MAX_OUTPUT_TOKENS}
+    return None
+
+
+@app.get("/admin/usage", response_model=UsageSummary)
+async def admin_usage_summary(_: bool = Depends(verify_admin)):
+    return UsageSummary(
+        total=USAGE_TOTAL,
+        companies=USAGE_BY_COMPANY,
+        campaigns=USAGE_BY_CAMPAIGN,
+    )
+
+
+@app.get("/admin/usage/simulations", response_model=Dict[str, UsageTotals])
+async def admin_usage_by_simulation(_: bool = Depends(verify_admin)):
+    return USAGE_BY_SIMULATION
+
+
+@app.get("/admin/usage/reports", response_model=Dict[str, UsageTotals])
+async def admin_usage_reports_by_simulation(_: bool = Depends(verify_admin)):
+    return USAGE_BY_SIMULATION_REPORTS
+
+
+@app.get("/admin/usage/simulations/{simulation_id}", response_model=UsageTotals)
+async def admin_usage_for_simulation(
+    simulation_id: str,
+    _: bool = Depends(verify_admin),
+):
+    usage = USAGE_BY_SIMULATION.get(simulation_id)
+    if usage is None:
+        raise HTTPException(status_code=404, detail="해당 시뮬레이션의 사용량 기록이 없습니다.")
+    return usage
+
+
+# ============================================================
+# 3-C. 첫 턴 응답 캐시
+# ============================================================
+# 워크숍 시작 인사("요즘 어떻게 지내요?" 등)는 거의 같으므로,
+# 키마다 서로 다른 답변을 OPENING_CACHE_POOL_SIZE 개까지 모아두고
+# 풀이 다 차면 그 중 하나를 골라 Gemini 호출 없이 돌려준다.
+OpeningCacheKey = Tuple[str, int, str]  # (persona_key, prompt_version, 정규화된 발화)
+
+
+class OpeningCacheStats(BaseModel):
+    enabled: bool
+    size: int
+    max_keys: int
+    pool_size: int
+    hits: int
+    misses: int
+    evictions: int
+    hit_rate: float
+
+
+OPENING_REPLY_CACHE: "OrderedDict[OpeningCacheKey, List[str]]" = OrderedDict()
+_opening_cache_counters = {"hits": 0, "misses": 0, "evictions": 0}
+_opening_cache_lock = threading.Lock()
+
+
+def normalize_opening_message(message: str) -> str:
+    """대소문자/전각/문장부호/공백 차이를 없앤다. ("요즘 어떻게 지내요?" == "요즘  어떻게 지내요~")"""
+    text = unicodedata.normalize("NFKC", message).lower()
+    text = re.sub(r"[^\w\s]", "", text)
+    return " ".join(text.split())
+
+
+def opening_cache_key(persona_prompt: CompiledPersonaPrompt, message: str) -> OpeningCacheKey:
+    return (persona_prompt.persona_key, persona_prompt.version, normalize_opening_message(message))
+
+
+def get_cached_opening_reply(key: OpeningCacheKey) -> Optional[str]:
+    """풀이 다 찬 키면 무작위 답변 하나를, 아니면 None(미스)을 돌려준다."""
+    with _opening_cache_lock:
+        pool = OPENING_REPLY_CACHE.get(key)
+        if pool is not None and len(pool) >= OPENING_CACHE_POOL_SIZE:
+            OPENING_REPLY_CACHE.move_to_end(key)
+            _opening_cache_counters["hits"] += 1
+            return random.choice(pool)
+        _opening_cache_counters["misses"] += 1
+        return None
+
+
+def store_opening_reply(key: OpeningCacheKey, reply: str) -> None:
+    with _opening_cache_lock:
+        pool = OPENING_REPLY_CACHE.setdefault(key, [])
+        OPENING_REPLY_CACHE.move_to_end(key)
+        if reply not in pool and len(pool) < OPENING_CACHE_POOL_SIZE:
+            pool.append(reply)
+        while len(OPENING_REPLY_CACHE) > OPENING_CACHE_MAX_KEYS:
+            OPENING_REPLY_CACHE.popitem(last=False)
+            _opening_cache_counters["evictions"] += 1
+
+
+def seed_opening_turn(chat_session, prompt: str, reply: str) -> None:
+    """캐시 응답을 실제로 주고받은 것처럼 새 세션 history 에 넣어둔다."""
+    chat_session.history = list(chat_session.history) + [
+        {"role": "user", "parts": [prompt]},
+        {"role": "model", "parts": [reply]},
+    ]
+
+
+@app.get("/admin/cache/opening", response_model=OpeningCacheStats)
+async def admin_opening_cache_stats(_: bool = Depends(verify_admin)):
+    with _opening_cache_lock:
+        hits = _opening_cache_counters["hits"]
+        misses = _opening_cache_counters["misses"]
+        return OpeningCacheStats(
+            enabled=OPENING_CACHE_ENABLED,
+            size=len(OPENING_REPLY_CACHE),
+            max_keys=OPENING_CACHE_MAX_KEYS,
+            pool_size=OPENING_CACHE_POOL_SIZE,
+            hits=hits,
+            misses=misses,
+            evictions=_opening_cache_counters["evictions"],
+            hit_rate=hits / (hits + misses) if hits + misses else 0.0,
+        )
+
+
+@app.delete("/admin/cache/opening")
+async def admin_clear_opening_cache(_: bool = Depends(verify_admin)):
+    with _opening_cache_lock:
+        OPENING_REPLY_CACHE.clear()
+    return {"status": "ok", "message": "첫 턴 응답 캐시를 비웠습니다."}
+
+
+# ============================================================
+# 3-D. Idempotency-Key (재시도로 인한 중복 Gemini 호출 방지)
+# ============================================================
+class _IdempotencyEntry:
+    __slots__ = ("fingerprint", "future", "completed_at")
+
+    def __init__(self, fingerprint: str, future: "asyncio.Future"):
+        self.fingerprint = fingerprint
+        self.future = future
+        self.completed_at: Optional[float] = None  # 진행 중이면 None
+
+
+# (endpoint, access_token, Idempotency-Key) -> 진행 중이거나 완료된 응답
+IDEMPOTENCY_ENTRIES: "OrderedDict[Tuple[str, str, str], _IdempotencyEntry]" = OrderedDict()
+
+
+def _purge_idempotency_entries() -> None:
+    """
+    완료된 응답만 오래된 순서로 지운다. 진행 중인 호출은 중복 요청이 붙을 수 있도록
+    최대 개수를 넘더라도 남겨둔다.
+    """
+    now = time.monotonic()
+    excess = len(IDEMPOTENCY_ENTRIES) - IDEMPOTENCY_MAX_ENTRIES
+    expired_keys = []
+    # 앞쪽(오래된 쪽)부터 보다가 지울 필요가 없는 완료 항목을 만나면 멈춘다
+    for key, entry in IDEMPOTENCY_ENTRIES.items():
+        if entry.completed_at is None:
+            continue
+        if excess <= 0 and now - entry.completed_at <= IDEMPOTENCY_TTL_SECONDS:
+            break
+        expired_keys.append(key)
+        excess -= 1
+    for key in expired_keys:
+        del IDEMPOTENCY_ENTRIES[key]
+
+
+async def run_idempotent(
+    endpoint: str,
+    access: AccessContext,
+    idempotency_key: Optional[str],
+    payload: BaseModel,
+    handler: Callable[[], Awaitable[Any]],
+) -> Any:
+    """
+    같은 Idempotency-Key 요청은 한 번만 처리한다.
+    - 처리 중인 중복 요청: 진행 중인 호출의 결과를 함께 기다린다.
+    - 완료된 중복 요청: 저장된 응답을 그대로 돌려준다. (Gemini 호출 없음)
+    - 실패한 요청은 저장하지 않으므로 같은 키로 다시 시도할 수 있다.
+    """
+    if not idempotency_key:
+        return await handler()
+
+    fingerprint = hashlib.sha256(
+        json.dumps(jsonable_encoder(payload), sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    key = (endpoint, access.access_token, idempotency_key)
+
+    _purge_idempotency_entries()
+    entry = IDEMPOTENCY_ENTRIES.get(key)
+    if entry is not None:
+        if entry.fingerprint != fingerprint:
+            raise HTTPException(
+                status_code=422,
+                detail="같은 Idempotency-Key 를 다른 요청에 다시 사용할 수 없습니다.",
+            )
+        # 기다리던 요청이 끊겨도 원래 호출은 계속되도록 shield
+        return await asyncio.shield(entry.future)
+
+    entry = _IdempotencyEntry(fingerprint, asyncio.get_running_loop().create_future())
+    IDEMPOTENCY_ENTRIES[key] = entry
+    try:
+        result = await handler()
+    except asyncio.CancelledError:
+        # 원래 요청이 끊겨도 기다리던 중복 요청은 정상적인 HTTP 오류를 받도록 한다
+        IDEMPOTENCY_ENTRIES.pop(key, None)
+        entry.future.set_exception(
+            HTTPException(
+                status_code=503,
+                detail="같은 요청의 처리가 중단되었습니다. 잠시 후 다시 시도해 주세요.",
+            )
+        )
+        entry.future.exception()
+        raise
+    except Exception as e:
+        IDEMPOTENCY_ENTRIES.pop(key, None)
+        entry.future.set_exception(e)
+        entry.future.exception()  # 기다리는 요청이 없어도 경고가 남지 않도록
+        raise
+
+    entry.completed_at = time.monotonic()
+    entry.future.set_result(result)
+    return result
 
 
 # ============================================================
 # 4. Request / Response 모델 (시뮬레이션 & 리포트)
 # ============================================================
+# 리포트에 들어가는 시뮬레이션 정보 (/chat 에서 함께 보내면 리포트 초안을 미리 만든다)
+class ReportContext(BaseModel):
+    company_id: str
+    topic: Dict[str, str]
+    persona: Dict[str, str]
+    situation: Dict[str, str]
+    agenda: Optional[str] = ""
+
+
 class ChatRequest(BaseModel):
     message: str
     persona: str
     simulation_id: Optional[str] = None
+    report_context: Optional[ReportContext] = None
 
 
 class ChatResponse(BaseModel):
     simulation_id: str
     reply: str
+    prompt_version: int
+    budget_warning: bool = False  # 예산이 얼마 남지 않아 답변 길이를 줄인 경우 True
 
 
 class ReportChatMessage(BaseModel):
@@ -530,12 +1367,8 @@ class ReportChatMessage(BaseModel):
     time: Optional[str] = None
 
 
-class ReportRequest(BaseModel):
-    company_id: str
-    topic: Dict[str, str]
-    persona: Dict[str, str]
-    situation: Dict[str, str]
-    agenda: Optional[str] = ""
+class ReportRequest(ReportContext):
+    simulation_id: Optional[str] = None
     chatHistory: List[ReportChatMessage]
     lastUserMessage: Optional[str] = ""
     lastCoachReply: Optional[str] = ""
@@ -553,44 +1386,93 @@ async def health():
 # 6. 시뮬레이션 채팅 엔드포인트
 # ============================================================
 @app.post("/chat", response_model=ChatResponse)
-async def chat(req: ChatRequest, access: AccessContext = Depends(get_current_access)):
+async def chat(
+    req: ChatRequest,
+    access: AccessContext = Depends(get_current_access),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
     """
     리더의 발화를 받아서, 선택된 팀원 페르소나 관점에서 답변을 생성한다.
     access 에서 company_id / campaign_code 를 나중에 로그/DB에 활용 가능.
+    Idempotency-Key 헤더가 있으면 재시도된 요청은 Gemini 를 다시 호출하지 않는다.
     """
+    return await run_idempotent(
+        "chat", access, idempotency_key, req, lambda: chat_turn(req, access)
+    )
+
+
+async def chat_turn(req: ChatRequest, access: AccessContext) -> ChatResponse:
     msg = req.message.strip()
     if not msg:
         raise HTTPException(status_code=400, detail="message is empty")
 
-    sim_id, chat_session = get_or_create_session(req.simulation_id, req.persona)
+    if req.simulation_id in SESSIONS and find_owned_simulation(req.simulation_id, access) is None:
+        raise HTTPException(status_code=404, detail="해당 시뮬레이션을 찾을 수 없습니다.")
 
-    # 리더의 발화를 짧은 프롬프트로 감싸서 보낸다
-    prompt = (
-        f"리더: {msg}\n\n"
-        "위 문장을 방금 들은 팀원 입장에서 대답해라.\n"
-        "- 자연스러운 한국어 존댓말\n"
-        "- 2~4문장\n"
-        "- AI, 프롬프트, 시뮬레이션 같은 단어는 절대 언급하지 말 것\n"
-        "- 지금 느끼는 감정, 걱정, 기대를 솔직하게 표현할 것"
+    is_new_session = not req.simulation_id or req.simulation_id not in SESSIONS
+    sim_id, chat_session, persona_prompt = get_or_create_session(
+        req.simulation_id, req.persona, access
     )
 
-    try:
-        response = chat_session.send_message(prompt)
-        reply_text = (response.text or "").strip()
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Gemini 오류: {e}")
-
-    if not reply_text:
-        reply_text = "말문이 막히네요… 한 번만 더 물어봐 주시겠어요?"
-
-    return ChatResponse(simulation_id=sim_id, reply=reply_text)
+    # 같은 시뮬레이션의 턴은 한 번에 하나씩 처리한다.
+    # (동시에 보내면 ChatSession history 에서 한 턴이 사라지고, 예산 검사도 어긋난다)
+    async with SESSION_LOCKS[sim_id]:
+        generation_config = check_chat_budget(sim_id)
+
+        # 리더의 발화를 미리 조립된 턴 지시문으로 감싸서 보낸다
+        prompt = persona_prompt.render_turn(msg)
+
+        cache_key = None
+        cached_reply = None
+        if is_new_session and OPENING_CACHE_ENABLED:
+            cache_key = opening_cache_key(persona_prompt, msg)
+            # 문장부호/이모지만 있는 발화("…", "👋")는 모두 빈 키가 되므로 캐시하지 않는다
+            if not cache_key[2]:
+                cache_key = None
+        if cache_key is not None:
+            cached_reply = get_cached_opening_reply(cache_key)
+
+        if cached_reply is not None:
+            seed_opening_turn(chat_session, prompt, cached_reply)
+            record_usage(access, sim_id, None, is_turn=True)
+            reply_text = cached_reply
+        else:
+            try:
+                response = await chat_session.send_message_async(
+                    prompt, generation_config=generation_config
+                )
+                reply_text = (response.text or "").strip()
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Gemini 오류: {e}")
+
+            record_usage(access, sim_id, response, is_turn=True)
+
+            if cache_key is not None and reply_text:
+                store_opening_reply(cache_key, reply_text)
+
+        if not reply_text:
+            reply_text = "말문이 막히네요… 한 번만 더 물어봐 주시겠어요?"
+
+        if REPORT_DRAFT_ENABLED and req.report_context is not None:
+            schedule_report_draft(sim_id, access, req.report_context, msg, reply_text)
+
+        return ChatResponse(
+            simulation_id=sim_id,
+            reply=reply_text,
+            prompt_version=persona_prompt.version,
+            budget_warning=generation_config is not None,
+        )
 
 
 # ============================================================
 # 7. 리포트 생성 엔드포인트 (+ 데이터 로그 저장)
 # ============================================================
 @app.post("/report")
-async def report(req: ReportRequest, access: AccessContext = Depends(get_current_access)):
+async def report(
+    req: ReportRequest,
+    access: AccessContext = Depends(get_current_access),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
     """
     대화 로그 기반으로 리더십 피드백 리포트 생성
     기대 응답 형식:
@@ -601,39 +1483,41 @@ async def report(req: ReportRequest, access: AccessContext = Depends(get_current
       "coachNote": "..."
     }
     """
-    model = genai.GenerativeModel(MODEL_NAME)
+    return await run_idempotent(
+        "report", access, idempotency_key, req, lambda: generate_report(req, access)
+    )
 
-    # 대화 로그를 사람이 읽기 좋은 형태로 정리
-    history_lines = []
-    for m in req.chatHistory:
-        speaker = "리더" if m.role == "leader" else "팀원"
-        history_lines.append(f"{speaker}: {m.text}")
-    history_text = "\n".join(history_lines)
 
-    prompt = f"""
-당신은 조직개발·리더십 코치입니다.
+def format_history(messages: List[Tuple[str, str]]) -> str:
+    """(role, text) 목록을 사람이 읽기 좋은 대화 로그로 정리"""
+    return "\n".join(
+        f"{'리더' if role == 'leader' else '팀원'}: {text}" for role, text in messages
+    )
 
+
+def report_context_block(ctx: ReportContext, access: AccessContext) -> str:
+    return f"""
 [회사 정보]
-- Company ID(프론트에서 보낸 값): {req.company_id}
+- Company ID(프론트에서 보낸 값): {ctx.company_id}
 - Access Company(토큰 기준): {access.company_id}
 - Campaign Code: {access.campaign_code}
 
 [리더십 주제]
-- {req.topic.get("label")}
+- {ctx.topic.get("label")}
 
 [상황]
-- {req.situation.get("title")}
+- {ctx.situation.get("title")}
 
 [선택한 팀원 페르소나]
-- 이름: {req.persona.get("displayName")}
-- 유형: {req.persona.get("name")}
+- 이름: {ctx.persona.get("displayName")}
+- 유형: {ctx.persona.get("name")}
 
 [리더가 미리 정리한 면담 아젠다]
-{req.agenda or "(입력 없음)"}
+{ctx.agenda or "(입력 없음)"}
+"""
 
-[리더와 팀원 사이의 실제 대화 로그]
-{history_text}
 
+REPORT_FORMAT_INSTRUCTIONS = """
 위 정보를 바탕으로,
 리더에게 제공할 피드백 리포트를 다음 구조로 작성해 주세요.
 
@@ -654,11 +1538,47 @@ async def report(req: ReportRequest, access: AccessContext = Depends(get_current
 - 한국어 존댓말로 작성한다.
 """
 
-    try:
-        response = model.generate_content(prompt)
-        full_text = (response.text or "").strip()
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Gemini 오류: {e}")
+
+def build_report_prompt(ctx: ReportContext, access: AccessContext, history_text: str) -> str:
+    return f"""
+당신은 조직개발·리더십 코치입니다.
+{report_context_block(ctx, access)}
+[리더와 팀원 사이의 실제 대화 로그]
+{history_text}
+{REPORT_FORMAT_INSTRUCTIONS}"""
+
+
+def build_report_update_prompt(
+    ctx: ReportContext,
+    access: AccessContext,
+    previous_report: str,
+    new_history_text: str,
+) -> str:
+    """이전 초안 + 새로 이어진 대화만 넣어 리포트를 갱신한다. (전체 로그를 다시 넣지 않음)"""
+    return f"""
+당신은 조직개발·리더십 코치입니다.
+아래 [기존 리포트 초안]은 지금까지의 대화를 바탕으로 작성한 것입니다.
+그 뒤에 이어진 대화를 반영해서 리포트 전체를 다시 작성해 주세요.
+{report_context_block(ctx, access)}
+[기존 리포트 초안]
+{previous_report}
+
+[이후 이어진 대화 로그]
+{new_history_text}
+{REPORT_FORMAT_INSTRUCTIONS}"""
+
+
+async def generate_report(req: ReportRequest, access: AccessContext) -> Dict[str, Any]:
+    # 클라이언트가 보낸 simulation_id 는 같은 회사/캠페인 것일 때만 사용한다
+    sim_record = find_owned_simulation(req.simulation_id, access)
+    simulation_id = sim_record.simulation_id if sim_record else None
+
+    # 대화 중에 미리 만들어 둔 초안이 최신이면 그대로 쓴다
+    full_text = await get_fresh_report_draft(req, simulation_id)
+    if simulation_id:
+        REPORT_DRAFTS.pop(simulation_id, None)
+    if full_text is None:
+        full_text = await generate_full_report(req, access, simulation_id)
 
     # 간단 파서: 큰 섹션 나누기 (실제 서비스에서는 더 정교하게 해도 됨)
     def extract_section(label: str, default: str = "") -> str:
@@ -691,13 +1611,14 @@ async def report(req: ReportRequest, access: AccessContext = Depends(get_current
         id=str(uuid.uuid4()),
         company_id=access.company_id,
         campaign_code=access.campaign_code,
-        simulation_id=None,  # 필요하면 프론트에서 simulation_id도 같이 보내도록 확장
+        simulation_id=simulation_id,
         persona=req.persona.get("name", ""),
         created_at=datetime.utcnow().isoformat(),
         topic=req.topic.get("label"),
         situation=req.situation.get("title"),
         last_user_message=req.lastUserMessage or "",
         last_coach_reply=req.lastCoachReply or "",
+        prompt_version=sim_record.prompt_version if sim_record else None,
     )
     CONVERSATION_LOGS.append(log)
 
@@ -707,3 +1628,148 @@ async def report(req: ReportRequest, access: AccessContext = Depends(get_current
         "improvements": improvements_list,
         "coachNote": coach_note,
     }
+
+
+async def generate_full_report(
+    req: ReportRequest,
+    access: AccessContext,
+    simulation_id: Optional[str],
+) -> str:
+    model = genai.GenerativeModel(MODEL_NAME)
+    history_text = format_history([(m.role, m.text) for m in req.chatHistory])
+    prompt = build_report_prompt(req, access, history_text)
+
+    try:
+        response = await model.generate_content_async(prompt)
+        full_text = (response.text or "").strip()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Gemini 오류: {e}")
+
+    record_usage(access, simulation_id, response, is_report=True)
+    return full_text
+
+
+# ============================================================
+# 8. 리포트 초안 미리 만들기 (REPORT_DRAFT_ENABLED)
+# ============================================================
+# /chat 한 턴이 끝날 때마다 백그라운드에서 초안을 갱신해 두고,
+# /report 는 대화 로그가 초안과 일치하면 Gemini 호출 없이 초안을 돌려준다.
+class ReportDraft:
+    __slots__ = ("context", "context_key", "transcript", "covered", "text", "task")
+
+    def __init__(self, context: ReportContext):
+        self.context = context
+        self.context_key = report_context_key(context)
+        self.transcript: List[Tuple[str, str]] = []  # (role, text), role: leader | member
+        self.covered = 0                             # text 에 반영된 transcript 길이
+        self.text: Optional[str] = None
+        self.task: Optional["asyncio.Task"] = None
+
+
+# 오래된 순서로 REPORT_DRAFT_MAX_ENTRIES 개까지만 보관한다. /report 에서 쓰면 바로 지운다.
+REPORT_DRAFTS: "OrderedDict[str, ReportDraft]" = OrderedDict()
+
+# 초안 작업은 채팅보다 우선순위가 낮으므로 동시에 몇 개만 돌린다
+_report_draft_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def report_context_key(ctx: ReportContext) -> str:
+    return json.dumps(
+        [ctx.company_id, ctx.topic, ctx.persona, ctx.situation, ctx.agenda or ""],
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+
+
+def schedule_report_draft(
+    simulation_id: str,
+    access: AccessContext,
+    ctx: ReportContext,
+    leader_text: str,
+    member_text: str,
+) -> None:
+    draft = REPORT_DRAFTS.get(simulation_id)
+    if draft is None:
+        draft = REPORT_DRAFTS[simulation_id] = ReportDraft(ctx)
+    elif draft.context_key != report_context_key(ctx):
+        # 주제/상황/아젠다가 바뀌면 초안을 처음부터 다시 만든다
+        draft.context = ctx
+        draft.context_key = report_context_key(ctx)
+        draft.covered = 0
+        draft.text = None
+
+    draft.transcript += [("leader", leader_text), ("member", member_text)]
+    REPORT_DRAFTS.move_to_end(simulation_id)
+    while len(REPORT_DRAFTS) > REPORT_DRAFT_MAX_ENTRIES:
+        REPORT_DRAFTS.popitem(last=False)
+
+    # 이미 갱신 중이면 그 작업이 끝난 뒤 새 턴까지 이어서 반영한다
+    if draft.task is None or draft.task.done():
+        draft.task = asyncio.create_task(update_report_draft(simulation_id, draft, access))
+
+
+async def update_report_draft(
+    simulation_id: str,
+    draft: ReportDraft,
+    access: AccessContext,
+) -> None:
+    """draft 는 REPORT_DRAFTS 에서 지워져도(리포트 사용/보관 한도) 이 작업 안에서는 그대로 쓴다."""
+    global _report_draft_semaphore
+    if _report_draft_semaphore is None:
+        _report_draft_semaphore = asyncio.Semaphore(REPORT_DRAFT_CONCURRENCY)
+
+    while draft.covered < len(draft.transcript):
+        target = len(draft.transcript)
+        context_key = draft.context_key
+        if draft.text is None:
+            prompt = build_report_prompt(
+                draft.context, access, format_history(draft.transcript[:target])
+            )
+        else:
+            prompt = build_report_update_prompt(
+                draft.context,
+                access,
+                draft.text,
+                format_history(draft.transcript[draft.covered:target]),
+            )
+
+        try:
+            async with _report_draft_semaphore:
+                response = await genai.GenerativeModel(MODEL_NAME).generate_content_async(prompt)
+            text = (response.text or "").strip()
+        except Exception:
+            # 초안은 최선 노력: 실패하면 /report 가 전체 생성으로 대신한다
+            return
+
+        record_usage(access, simulation_id, response, is_report=True)
+        if not text:
+            return
+        if draft.context_key == context_key:
+            draft.text = text
+            draft.covered = target
+
+
+async def get_fresh_report_draft(
+    req: ReportRequest,
+    simulation_id: Optional[str],
+) -> Optional[str]:
+    """대화 로그와 리포트 정보가 초안과 정확히 일치할 때만 초안을 돌려준다."""
+    draft = REPORT_DRAFTS.get(simulation_id) if simulation_id else None
+    if draft is None or draft.context_key != report_context_key(req):
+        return None
+
+    history = [("leader" if m.role == "leader" else "member", m.text) for m in req.chatHistory]
+    if history != draft.transcript:
+        return None
+
+    # 마지막 턴을 반영하는 중이면 잠깐만 기다린다. 초안 작업이 다른 시뮬레이션 뒤에
+    # 줄 서 있을 수 있으므로, 시간 안에 끝나지 않으면 전체 생성으로 대신한다.
+    if draft.covered < len(draft.transcript) and draft.task is not None:
+        try:
+            await asyncio.wait_for(asyncio.shield(draft.task), REPORT_DRAFT_WAIT_SECONDS)
+        except Exception:  # asyncio.TimeoutError 포함
+            return None
+
+    if draft.covered == len(draft.transcript):
+        return draft.text
+    return None
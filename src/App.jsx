@@ -1,4 +1,4 @@
-import { useEffect, useState } from 'react';
+import { useEffect, useRef, useState } from 'react';
 import './App.css';
 import AdminDashboard from './AdminDashboard';
 
@@ -189,13 +189,20 @@ function App() {
 
   // Step5: 채팅
   const [chatInput, setChatInput] = useState('');
-  const [chatHistory, setChatHistory] = useState([]); // {from:'leader'|'member', text}
+  // {from:'leader'|'member', text, time}
+  // 리더 메시지에는 재전송 시 재사용할 idempotencyKey 와 전송 실패 여부(failed)가 붙는다
+  const [chatHistory, setChatHistory] = useState([]);
   const [isChatLoading, setIsChatLoading] = useState(false);
+  // 대화 한도 안내 (chatHistory 에 넣지 않는 시스템 메시지)
+  const [chatNotice, setChatNotice] = useState(null);
+  const [isChatLimitReached, setIsChatLimitReached] = useState(false);
 
   // Step6: 분석 결과
   const [analysis, setAnalysis] = useState(null);
   const [isAnalysisLoading, setIsAnalysisLoading] = useState(false);
   const [analysisError, setAnalysisError] = useState(null);
+  // 같은 리포트 요청(payload)에는 같은 Idempotency-Key 를 재사용한다
+  const reportRequestKeyRef = useRef({ signature: null, key: null });
 
   // 테마 변경 시 html data-theme 변경
   useEffect(() => {
@@ -211,6 +218,25 @@ function App() {
   const selectedSituation =
     situations.find((s) => s.id === selectedSituationId) || null;
 
+  // 리포트에 들어가는 시뮬레이션 정보 (/chat, /report 공통)
+  const buildReportContext = () => ({
+    company_id: COMPANY_ID,
+    topic: {
+      id: selectedTopic.id,
+      label: selectedTopic.label,
+    },
+    persona: {
+      id: selectedPersona.id,
+      name: selectedPersona.name,
+      displayName: selectedPersona.displayName,
+    },
+    situation: {
+      id: selectedSituation.id,
+      title: selectedSituation.title,
+    },
+    agenda,
+  });
+
   // -----------------------------
   // 3-1. 네비게이션 제어
   // -----------------------------
@@ -247,6 +273,8 @@ function App() {
     setAgenda('');
     setChatInput('');
     setChatHistory([]);
+    setChatNotice(null);
+    setIsChatLimitReached(false);
     setAnalysis(null);
     setAnalysisError(null);
     setSimulationId(null);
@@ -265,13 +293,31 @@ function App() {
       return;
     }
 
-    // 1) 리더 메시지 추가
-    const newHistory = [
-      ...chatHistory,
-      { from: 'leader', text: trimmed, time: new Date().toISOString() },
-    ];
-    setChatHistory(newHistory);
+    // 1) 리더 메시지 추가 (재전송해도 서버가 한 번만 처리하도록 메시지마다 키를 하나 둔다)
+    const leaderEntry = {
+      from: 'leader',
+      text: trimmed,
+      time: new Date().toISOString(),
+      idempotencyKey: crypto.randomUUID(),
+      failed: false,
+    };
+    setChatHistory((prev) => [...prev, leaderEntry]);
     setChatInput('');
+    await sendLeaderMessage(leaderEntry);
+  };
+
+  // 전송에 실패한 리더 메시지를 같은 Idempotency-Key 로 다시 보낸다
+  const handleRetryChat = async (leaderEntry) => {
+    setChatHistory((prev) =>
+      prev.map((m) =>
+        m.idempotencyKey === leaderEntry.idempotencyKey ? { ...m, failed: false } : m,
+      ),
+    );
+    await sendLeaderMessage(leaderEntry);
+  };
+
+  const sendLeaderMessage = async (leaderEntry) => {
+    const isThisEntry = (m) => m.idempotencyKey === leaderEntry.idempotencyKey;
     setIsChatLoading(true);
 
     try {
@@ -279,20 +325,36 @@ function App() {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'Idempotency-Key': leaderEntry.idempotencyKey,
           ...(ACCESS_TOKEN && { 'X-Access-Token': ACCESS_TOKEN }),
         },
         body: JSON.stringify({
-          message: trimmed,
+          message: leaderEntry.text,
           persona: selectedPersona?.id ?? 'quiet',
           simulation_id: simulationId, // 첫 턴엔 null, 이후엔 유지
+          report_context: buildReportContext(), // 서버가 리포트 초안을 미리 만들 때 사용
         }),
       });
 
+      if (res.status === 429) {
+        // 시뮬레이션 대화 한도 도달: 팀원 답변이 아니므로 대화 로그 밖에 안내하고,
+        // 서버가 처리하지 않은 리더 메시지는 로그에서 되돌린다
+        const err = await res.json().catch(() => null);
+        setChatHistory((prev) => prev.filter((m) => !isThisEntry(m)));
+        setChatNotice(err?.detail || '이번 시뮬레이션의 대화 한도에 도달했습니다.');
+        setIsChatLimitReached(true);
+        return;
+      }
+
       if (!res.ok) {
         throw new Error('백엔드 응답 오류');
       }
 
-      const data = await res.json(); // { simulation_id, reply }
+      const data = await res.json(); // { simulation_id, reply, budget_warning }
+
+      if (data.budget_warning) {
+        setChatNotice('대화 한도가 얼마 남지 않았습니다. 이제 대화를 마무리해 보세요.');
+      }
 
       if (!simulationId && data.simulation_id) {
         setSimulationId(data.simulation_id);
@@ -310,14 +372,10 @@ function App() {
       ]);
     } catch (error) {
       console.error(error);
-      setChatHistory((prev) => [
-        ...prev,
-        {
-          from: 'member',
-          text: '서버와 연결이 원활하지 않아, 임시로 응답을 가져오지 못했습니다.',
-          time: new Date().toISOString(),
-        },
-      ]);
+      // 팀원 답변처럼 보이지 않도록, 리더 메시지에 실패 표시만 하고 재시도를 안내한다
+      setChatHistory((prev) =>
+        prev.map((m) => (isThisEntry(m) ? { ...m, failed: true } : m)),
+      );
     } finally {
       setIsChatLoading(false);
     }
@@ -347,30 +405,19 @@ function App() {
       setAnalysisError(null);
 
       try {
-        const lastUser = [...chatHistory]
+        // 전송에 실패한 리더 메시지는 팀원이 듣지 못한 말이므로 리포트에서 뺀다
+        const deliveredHistory = chatHistory.filter((m) => !m.failed);
+        const lastUser = [...deliveredHistory]
           .reverse()
           .find((m) => m.from === 'leader');
-        const lastMember = [...chatHistory]
+        const lastMember = [...deliveredHistory]
           .reverse()
           .find((m) => m.from === 'member');
 
         const payload = {
-          company_id: COMPANY_ID,
-          topic: {
-            id: selectedTopic.id,
-            label: selectedTopic.label,
-          },
-          persona: {
-            id: selectedPersona.id,
-            name: selectedPersona.name,
-            displayName: selectedPersona.displayName,
-          },
-          situation: {
-            id: selectedSituation.id,
-            title: selectedSituation.title,
-          },
-          agenda,
-          chatHistory: chatHistory.map((m) => ({
+          ...buildReportContext(),
+          simulation_id: simulationId,
+          chatHistory: deliveredHistory.map((m) => ({
             role: m.from === 'leader' ? 'leader' : 'member',
             text: m.text,
             time: m.time,
@@ -379,10 +426,17 @@ function App() {
           lastCoachReply: lastMember?.text || '',
         };
 
+        // 같은 대화 내용으로 리포트를 다시 요청하면 같은 키를 보내 중복 생성을 막는다
+        const signature = JSON.stringify(payload);
+        if (reportRequestKeyRef.current.signature !== signature) {
+          reportRequestKeyRef.current = { signature, key: crypto.randomUUID() };
+        }
+
         const res = await fetch(`${BACKEND_URL}/report`, {
           method: 'POST',
           headers: {
             'Content-Type': 'application/json',
+            'Idempotency-Key': reportRequestKeyRef.current.key,
             ...(ACCESS_TOKEN && { 'X-Access-Token': ACCESS_TOKEN }),
           },
           body: JSON.stringify(payload),
@@ -700,6 +754,20 @@ function App() {
                           {m.from === 'leader' ? '리더(나)' : '팀원 페르소나'}
                         </div>
                         <div className="chat-text">{m.text}</div>
+                        {m.failed && (
+                          <div className="chat-retry">
+                            전송하지 못했습니다.
+                            {idx === chatHistory.length - 1 && (
+                              <button
+                                type="button"
+                                onClick={() => handleRetryChat(m)}
+                                disabled={isChatLoading}
+                              >
+                                다시 시도
+                              </button>
+                            )}
+                          </div>
+                        )}
                       </div>
                     ))}
 
@@ -715,13 +783,20 @@ function App() {
                     )}
                   </div>
 
+                  {chatNotice && <p className="chat-notice">{chatNotice}</p>}
+
                   <form className="chat-input-area" onSubmit={handleSendChat}>
                     <textarea
                       value={chatInput}
                       onChange={(e) => setChatInput(e.target.value)}
+                      disabled={isChatLimitReached}
                       placeholder="여기에 리더로서의 말을 적고 Enter(또는 보내기 버튼)를 눌러보세요."
                     />
-                    <button type="submit" className="primary-btn" disabled={isChatLoading}>
+                    <button
+                      type="submit"
+                      className="primary-btn"
+                      disabled={isChatLoading || isChatLimitReached}
+                    >
                       {isChatLoading ? '응답 기다리는 중…' : '보내기'}
                     </button>
                   </form>